@@ -2,64 +2,103 @@
 python scripts/pull_cards.py
 """
 
+import csv
+import functools
 import os
 import re
+import shutil
+import threading
 import requests
-import pandas as pd
-from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
 from tqdm import tqdm
 
 URL = "https://tot.wiki/wiki/Cards"
+_URL_BASE = "https://tot.wiki"
 IMG_DIR = "data/icons"
 os.makedirs(IMG_DIR, exist_ok=True)
 
+# Only <table> elements are needed, so skip building the rest of the page
+_ONLY_TABLES = SoupStrainer("table")
+
+# Shared session so icon downloads reuse pooled keep-alive connections;
+# the pool holds one connection per worker so none of them wait for a socket
+MAX_WORKERS = 32
+SESSION = requests.Session()
+SESSION.headers.update({"User-Agent": "Mozilla/5.0"})
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=MAX_WORKERS))
+
+# Roman numeral tiers, Greek letter turn effects and "Lv. X" suffixes
+_SKILL_CLEAN_RE = re.compile(r'\s*(?:\bI{1,3}\b|[αβγ]|Lv\.\s*\d+)\s*')
+_WS_RE = re.compile(r'\s+')
+_NONALNUM_RE = re.compile(r'[^a-zA-Z0-9\s]+')
+_SAFE_RE = re.compile(r'[^a-zA-Z0-9_-]+')
+_DATE_RE = re.compile(r'<p>Cards database updated on \d{4}-\d{2}-\d{2}</p>')
+
+# Roman numerals give the skill tier, Greek letters the number of turns
+_TIER_MAP = {'I': 1, 'II': 2, 'III': 3}
+_TURN_MAP = {'α': 1, 'β': 2, 'γ': 3}
+
 def get_cards_table_soup(url: str) -> BeautifulSoup:
-    html = requests.get(url, headers={"User-Agent": "Mozilla/5.0"}, timeout=30).text
-    soup = BeautifulSoup(html, "lxml")
+    # The session negotiates gzip/deflate, plus Brotli when the brotli package is installed
+    html = SESSION.get(url, timeout=30).text
+    soup = BeautifulSoup(html, "lxml", parse_only=_ONLY_TABLES)
     
     required = {"Name", "Rarity", "Attribute", "Max Influence", "Max Defense", "Max Skill(s)"}
     
-    for table in soup.select("table"):
-        # Try to find headers in thead first
-        headers = []
-        thead = table.find("thead")
-        if thead:
-            headers = [th.get_text(strip=True) for th in thead.select("th")]
-
-        # If no thead or headers, try first row of tbody
-        if not headers:
-            tbody = table.find("tbody")
-            if tbody:
-                first_row = tbody.find("tr")
-                if first_row:
-                    headers = [th.get_text(strip=True) for th in first_row.select("th")]
-
-        # If still no headers, try first row of table
-        if not headers:
-            first_row = table.find("tr")
-            if first_row:
-                headers = [th.get_text(strip=True) for th in first_row.select("th")]
-
-        if headers and required.issubset(set(headers)):
+    for table in soup.find_all("table"):
+        # Skip tables whose header row cannot hold every required column
+        # before stringifying any of their headers
+        ths = header_cells(table)
+        if len(ths) < len(required):
+            continue
+
+        headers = [th.get_text(strip=True) for th in ths]
+        if required.issubset(set(headers)):
             return table
     
     # If we get here, let's print all tables to debug
     print("No matching table found. All tables found:")
-    for i, table in enumerate(soup.select("table")):
+    for i, table in enumerate(soup.find_all("table")):
         print(f"\nTable {i}:")
         print(table.prettify()[:500] + "..." if len(table.prettify()) > 500 else table.prettify())
     
     raise RuntimeError("Could not find the cards table")
 
+def header_cells(table):
+    """Return the <th> cells of a table, from its thead if it has any, otherwise its first body row"""
+    thead = table.find("thead")
+    ths = thead.find_all("th") if thead else []
+    if not ths:
+        tbody = table.find("tbody")
+        first_row = (tbody or table).find("tr")
+        ths = first_row.find_all("th") if first_row else []
+    return ths
+
+def table_headers(table):
+    """Return the header texts of a table"""
+    return [th.get_text(strip=True) for th in header_cells(table)]
+
 def extract_text(cell):
     return " ".join(s.strip() for s in cell.stripped_strings)
 
 def parse_name(name_text):
-    m = re.search(r'^(.*?)\s+"(.*?)"$', name_text)
-    if m:
-        return m.group(1), m.group(2)
-    parts = re.split(r'"', name_text)
-    return parts[0].strip(), (parts[1].strip() if len(parts) > 1 else "")
+    # Names look like: Luke Pearce "Light of Life and Love"
+    character, sep, rest = name_text.partition('"')
+    if not sep:
+        return name_text.strip(), ""
+    if rest.endswith('"'):
+        return character.strip(), rest[:-1]
+    return character.strip(), rest.partition('"')[0].strip()
+
+def absolute_url(src):
+    """Resolve an image src against the wiki, only falling back to urljoin for unusual forms"""
+    if src.startswith(("http://", "https://")):
+        return src
+    if src.startswith("/") and not src.startswith("//"):
+        return _URL_BASE + src
+    return requests.compat.urljoin(URL, src)
 
 def rarity_from_cell(td):
     img = td.find("img")
@@ -75,6 +114,7 @@ def extract_first_skill(skills_cell):
         return first_bold.get_text(strip=True)
     return ""
 
+@functools.lru_cache(maxsize=512)
 def extract_first_skill_display_name(first_skill):
     """Extract the display name of the first skill.
 
@@ -90,27 +130,16 @@ def extract_first_skill_display_name(first_skill):
     if not first_skill:
         return ""
     
-    # Parse the skill name to extract tier and turn effects
-    skill_parts = first_skill.split()
-    
-    # Find the tier (Roman numeral) - usually at the end
+    # Parse the skill name to extract the tier (Roman numeral) and
+    # turn effects (Greek letter) in a single pass over the tokens
     tier = 0
     turns = 0
-    
-    # Look for Roman numerals (I, II, III, IV, V, etc.)
-    for part in skill_parts:
-        if part in ['I', 'II', 'III']:
-            # Convert Roman numeral to number
-            roman_to_num = {'I': 1, 'II': 2, 'III': 3}
-            tier = roman_to_num[part]
-            break
-    
-    # Look for Greek letters (α, β, γ) which indicate turn effects
-    for part in skill_parts:
-        if part in ['α', 'β', 'γ']:
-            # Map Greek letters to turn counts
-            greek_to_turns = {'α': 1, 'β': 2, 'γ': 3}
-            turns = greek_to_turns[part]
+    for part in first_skill.split():
+        if not tier:
+            tier = _TIER_MAP.get(part, 0)
+        if not turns:
+            turns = _TURN_MAP.get(part, 0)
+        if tier and turns:
             break
     
     # Build the display string    
@@ -119,6 +148,7 @@ def extract_first_skill_display_name(first_skill):
     else:
         return f"Tier={tier}"
 
+@functools.lru_cache(maxsize=512)
 def extract_first_skill_icon(first_skill):
     """Extract the icon of the first skill.
     
@@ -131,44 +161,48 @@ def extract_first_skill_icon(first_skill):
         return ""
     
     # Clean the skill name by removing Roman numerals, Greek letters, and "Lv. X" parts
+    # in one pass, then collapse the leftover whitespace
     # Keep only the main skill name
-    skill_name = first_skill
-    
-    # Remove Roman numerals (I, II, III)
-    skill_name = re.sub(r'\s+I{1,3}\s*', ' ', skill_name)
-    
-    # Remove Greek letters (α, β, γ)
-    skill_name = re.sub(r'\s*[αβγ]\s*', ' ', skill_name)
-    
-    # Remove "Lv. X" patterns
-    skill_name = re.sub(r'\s*Lv\.\s*\d+\s*', ' ', skill_name)
-    
-    # Clean up extra whitespace and trim
-    skill_name = re.sub(r'\s+', ' ', skill_name).strip()
+    skill_name = _WS_RE.sub(' ', _SKILL_CLEAN_RE.sub(' ', first_skill)).strip()
     
     # Map to icon filename
     # Replace spaces and special characters with underscores
-    icon_filename = re.sub(r'[^a-zA-Z0-9\s]+', '', skill_name)  # Remove special chars
-    icon_filename = re.sub(r'\s+', '_', icon_filename)  # Replace spaces with underscores
+    icon_filename = _NONALNUM_RE.sub('', skill_name)  # Remove special chars
+    icon_filename = _WS_RE.sub('_', icon_filename)  # Replace spaces with underscores
     icon_filename = f"{icon_filename}_icon.png"
 
     return f"data/skill_icons/{icon_filename}"
     
     
 
-def download_icon(img_url, filename):
+def download_icon(session, img_url, filename):
+    path = os.path.join(IMG_DIR, filename)
+    path = path.replace("_png", ".png")
+    # Icons never change once published, so skip the request on re-runs
+    if os.path.exists(path):
+        return path
     if "width=" not in img_url:
         sep = "&" if "?" in img_url else "?"
         img_url = f"{img_url}{sep}width=50"
-    r = requests.get(img_url, headers={"User-Agent": "Mozilla/5.0"}, timeout=30)
-    if r.ok:
-        path = os.path.join(IMG_DIR, filename)
-        path = path.replace("_png", ".png")
-        if not os.path.exists(path):
-            with open(path, "wb") as f:
-                f.write(r.content)
-        return path
-    return None
+    # Stream the body straight to disk instead of holding it in memory;
+    # write to a .part file first and remove it on failure so an interrupted
+    # download is never mistaken for a cached icon on the next run.
+    # Different URLs can map to the same filename, so the .part file is
+    # per thread to keep concurrent downloads from writing into each other
+    part_path = f"{path}.{threading.get_ident()}.part"
+    with session.get(img_url, stream=True, timeout=30) as r:
+        if not r.ok:
+            return None
+        r.raw.decode_content = True
+        try:
+            with open(part_path, "wb") as f:
+                shutil.copyfileobj(r.raw, f)
+            os.replace(part_path, path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.unlink(part_path)
+            raise
+    return path
 
 def update_html_date():
     """Update the date in index.html to reflect when cards were last updated"""
@@ -186,11 +220,10 @@ def update_html_date():
         content = f.read()
     
     # Replace the date line
-    old_pattern = r'<p>Cards database updated on \d{4}-\d{2}-\d{2}</p>'
     new_line = f'<p>Cards database updated on {current_date}</p>'
     
-    if re.search(old_pattern, content):
-        content, num_replacements = re.subn(old_pattern, new_line, content)
+    if _DATE_RE.search(content):
+        content, num_replacements = _DATE_RE.subn(new_line, content)
         
         # Write back to the file
         with open(html_file, 'w', encoding='utf-8') as f:
@@ -202,70 +235,100 @@ def update_html_date():
 
 def main():
     table = get_cards_table_soup(URL)
-    print(f"Successfully found table with {len(table.select('tr'))} rows")
-    
-    # Try to find headers in thead first
-    headers = [th.get_text(strip=True) for th in table.select("thead th")]
-    
-    # If no thead headers, try first row
-    if not headers:
-        first_row = table.find("tr")
-        if first_row:
-            headers = [th.get_text(strip=True) for th in first_row.select("th")]
+    print(f"Successfully found table with {len(table.find_all('tr'))} rows")
     
+    headers = table_headers(table)
     idx = {h: i for i, h in enumerate(headers)}
     print(f"Table headers: {headers}")
     print(f"Column indices: {idx}")
     
-    records = []
+    col_card = []
+    col_char = []
+    col_rarity = []
+    col_attr = []
+    col_skill = []
+    col_skill_icon = []
+    col_skill_display = []
+    col_icon_url = []
+    # Unique icon URLs mapped to the filename they are saved under
+    downloads = {}
     # Try tbody first, then fall back to all rows
-    rows = table.select("tbody tr")
+    rows = [tr for tbody in table.find_all("tbody") for tr in tbody.find_all("tr")]
     if not rows:
-        rows = table.select("tr")[1:]  # Skip header row
+        rows = table.find_all("tr")[1:]  # Skip header row
     
+    name_i = idx["Name"]
+    rarity_i = idx["Rarity"]
+    attr_i = idx["Attribute"]
+    skill_i = idx["Max Skill(s)"]
+    num_cols = len(idx)
+
     for tr in tqdm(rows):
-        tds = tr.find_all("td")
-        if len(tds) < len(idx):
+        # Cells are always direct children of the row, like XPath "./td"
+        tds = tr.find_all("td", recursive=False)
+        if len(tds) < num_cols:
             continue
 
-        name_text = extract_text(tds[idx["Name"]])
+        name_td = tds[name_i]
+        name_text = extract_text(name_td)
         character, card = parse_name(name_text)
         if not card:
             continue
 
-        rarity = rarity_from_cell(tds[idx["Rarity"]])
-        attribute = extract_text(tds[idx["Attribute"]])
+        rarity = rarity_from_cell(tds[rarity_i])
+        attribute = extract_text(tds[attr_i])
         
         # Extract the first skill
-        first_skill = extract_first_skill(tds[idx["Max Skill(s)"]])
+        first_skill = extract_first_skill(tds[skill_i])
         first_skill_icon = extract_first_skill_icon(first_skill)
         first_skill_display_name = extract_first_skill_display_name(first_skill)
 
         # get the icon URL from the img tag in the Name cell
-        img = tds[idx["Name"]].find("img")
+        img = name_td.find("img")
         icon_url = None
-        local_path = None
         if img and img.get("src"):
-            icon_url = requests.compat.urljoin(URL, img["src"])
+            icon_url = absolute_url(img["src"])
             # make safe filename
-            safe_name = re.sub(r'[^a-zA-Z0-9_-]+', "_", f"{character}_{card}.png")
-            local_path = download_icon(icon_url, safe_name)
-
-        records.append({
-            "Card name": card,
-            "Character": character,
-            "Rarity": rarity,
-            "Attribute": attribute,
-            "First Skill": first_skill,
-            "First Skill Icon": first_skill_icon,
-            "First Skill Display Name": first_skill_display_name,
-            "Icon URL": icon_url,
-            "Local Icon Path": local_path
-        })
-
-    df = pd.DataFrame(records)
-    print(df.head(5))
-    df.to_csv("data/tot_cards_with_icons.csv", index=False)
+            safe_name = _SAFE_RE.sub("_", f"{character}_{card}.png")
+            downloads.setdefault(icon_url, safe_name)
+
+        col_card.append(card)
+        col_char.append(character)
+        col_rarity.append(rarity)
+        col_attr.append(attribute)
+        col_skill.append(first_skill)
+        col_skill_icon.append(first_skill_icon)
+        col_skill_display.append(first_skill_display_name)
+        col_icon_url.append(icon_url)
+
+    # Download each icon once, concurrently, and share the path across rows
+    with ThreadPoolExecutor(MAX_WORKERS) as ex:
+        paths = list(tqdm(ex.map(lambda j: download_icon(SESSION, *j), downloads.items()), total=len(downloads)))
+    url_to_path = dict(zip(downloads, paths))
+    col_local_path = [url_to_path.get(icon_url) for icon_url in col_icon_url]
+
+    columns = {
+        "Card name": col_card,
+        "Character": col_char,
+        "Rarity": col_rarity,
+        "Attribute": col_attr,
+        "First Skill": col_skill,
+        "First Skill Icon": col_skill_icon,
+        "First Skill Display Name": col_skill_display,
+        "Icon URL": col_icon_url,
+        "Local Icon Path": col_local_path
+    }
+
+    # Preview the first few rows
+    print(" | ".join(columns))
+    for row in zip(*(col[:5] for col in columns.values())):
+        print(" | ".join(str(v) for v in row))
+
+    # Write the collected rows to the CSV
+    with open("data/tot_cards_with_icons.csv", "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(columns)
+        writer.writerows(zip(*columns.values()))
     
     # Update the HTML file with the current date
     update_html_date()